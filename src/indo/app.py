@@ -1,12 +1,21 @@
 import openai 
+import httpx
 import streamlit as st
 
-import json 
+import orjson
+import hashlib
+import re
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any
 
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from ui import display_calculation_results, create_sidebar
 from calculation import CalculationService
-from prompts import GREETING_PROMPT, NEGATIVE_FEEDBACK_PROMPT, IRREVELANT_PROMPT, ENTITY_EXTRACTOR_PROMPT, INTENT_PROMPT, INTENT_RESPONSE_FORMAT, ENTITY_EXTRACTOR_RESPONSE_FORMAT, DATA_SUMMARY_PROMPT, USER_CONFIRMATION_STATE_PROMPT, USER_CONFIRMATION_STATE_RESPONSE_FORMAT 
+from prompts import GREETING_SYS_MSG, NEGATIVE_FEEDBACK_SYS_MSG, IRREVELANT_SYS_MSG, DATA_SUMMARY_SYS_MSG, COMBINED_SYS_MSG, CombinedResponse
 from auth import check_authentication, show_login_page, add_logout_button
 
 from config import SHEET_URL, OPENAI_API_KEY, CREDENTIALS_DATA
@@ -14,14 +23,32 @@ from config import SHEET_URL, OPENAI_API_KEY, CREDENTIALS_DATA
 LOGGING_CONFIG = {
     'level': logging.INFO,
     'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    'handlers': [
-        logging.FileHandler('indofast_copilot.log'),
-        logging.StreamHandler()
-    ]
+    'filename': 'indofast_copilot.log'
 }
 
 
-logging.basicConfig(**LOGGING_CONFIG)
+def configure_logging(config: dict = LOGGING_CONFIG):
+    """
+    Route log records through a queue so file and console writes happen
+    on a listener thread instead of the Streamlit script thread.
+    Streamlit re-executes this module on every rerun, so only set up once.
+    """
+    root_logger = logging.getLogger()
+    if any(isinstance(handler, QueueHandler) for handler in root_logger.handlers):
+        return
+    formatter = logging.Formatter(config['format'])
+    handlers = [logging.FileHandler(config['filename']), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.Queue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    root_logger.setLevel(config['level'])
+    root_logger.addHandler(QueueHandler(log_queue))
+
+
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Page configuration
@@ -35,68 +62,134 @@ PAGE_CONFIG = {
 
 
 
+STYLES_PATH = Path(__file__).with_name("styles.css")
+
+
+@st.cache_resource
+def load_css() -> str:
+    """Read the custom stylesheet once per process."""
+    return f"<style>{STYLES_PATH.read_text()}</style>"
+
+
 st.set_page_config(**PAGE_CONFIG)
 
 # Custom CSS for better styling
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        color: #1f77b4;
-        text-align: center;
-        margin-bottom: 1rem;
-    }
-    .sidebar-content {
-        background-color: #f0f2f6;
-        padding: 1rem;
-        border-radius: 10px;
-    }
-</style>
-""", unsafe_allow_html=True)
+st.markdown(load_css(), unsafe_allow_html=True)
 
 
 # Add your model's price per 1K tokens (example: $0.0015 for gpt-3.5-turbo)
 MODEL_PRICE_PER_INPUT_1K_TOKENS = 0.0004
 MODEL_PRICE_PER_OUTPUT_1K_TOKENS = 0.0016
 
+# Keep idle connections to the OpenAI API open between chat turns
+OPENAI_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=10, keepalive_expiry=120)
+# Maximum number of classifier responses kept per session
+RESPONSE_CACHE_SIZE = 256
+# Number of most recent messages sent to the classifier
+CLASSIFIER_WINDOW_SIZE = 6
+# Messages that are only a greeting or thanks, classified locally without an API call
+GREETING_FAST_PATH_RE = re.compile(r"^\s*(hi|hello|hey|thanks|thank you|gm|good (morning|evening))\b[\s!.,]*$", re.IGNORECASE)
+GREETING_FAST_PATH_MAX_LENGTH = 40
+# Per-location fields required before a calculation, with their display labels
+ENTITY_FIELD_LABELS = {
+    "station_utilization_percentage": "station utilization percentage",
+    "off_road_vehicle_percentage": "off road vehicle percentage",
+}
+REQUIRED_ENTITY_KEYS = frozenset(ENTITY_FIELD_LABELS)
+
 class OPENAI_CALL:
     def __init__(self, api_key: str):
-        openai.api_key = api_key
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            http_client=openai.DefaultHttpxClient(limits=OPENAI_HTTP_LIMITS),
+        )
+        self._cache: OrderedDict[str, tuple[Any, Any]] = OrderedDict()
+        self.last_stream_usage = None
+
+    def _cache_key(self, system_message: dict, messages: list[dict], format_name: str, model: str, temperature: float, max_tokens: int) -> str:
+        payload = orjson.dumps([system_message, messages, format_name, model, temperature, max_tokens], option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY, default=str)
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
 
-    def chat_completion(self, system_prompt: str, messages: list[dict], response_format = None, model: str = OPENAI_MODEL, temperature: float = 0.0, max_tokens: int = 500):
+    def chat_completion(self, system_message: dict, messages: list[dict], model: str = OPENAI_MODEL, temperature: float = 0.0, max_tokens: int = 500):
         """
-        Call OpenAI's chat completion API with the provided messages.
+        Call OpenAI's chat completion API with the provided messages,
+        prefixed by a prebuilt system message from prompts.py.
         Returns a tuple: (response_content, usage_dict)
         """
-        input_messages = []
-        if system_prompt:
-            input_messages.append({"role": "system", "content": system_prompt})
-        input_messages.extend(messages)
-        if response_format is not None:
-            response = openai.chat.completions.create(
-                model=model,
-                messages=input_messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                response_format=response_format,
-            )
-        else:
-            response = openai.chat.completions.create(
-                model=model,
-                messages=input_messages,
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
+        input_messages = [system_message, *messages] if system_message else list(messages)
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=input_messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
         # Extract usage info
         usage = response.usage if hasattr(response, "usage") else None
-        return response.choices[0].message.content, usage
+        content = response.choices[0].message.content
+        return content, usage
+
+    def chat_completion_parsed(self, system_message: dict, messages: list[dict], model_cls: type, model: str = OPENAI_MODEL, temperature: float = 0.0, max_tokens: int = 500):
+        """
+        Call OpenAI's structured output API and let the SDK validate the
+        response into model_cls, so no JSON decoding is needed by the caller.
+        Responses are cached on the message history, a cache hit returns
+        no usage since no request was made.
+        Returns a tuple: (parsed_model_or_None, usage_dict)
+        """
+        cache_key = self._cache_key(system_message, messages, model_cls.__name__, model, temperature, max_tokens)
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key][0], None
+
+        response = self.client.chat.completions.parse(
+            model=model,
+            messages=[system_message, *messages],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            response_format=model_cls,
+        )
+        usage = response.usage if hasattr(response, "usage") else None
+        parsed = response.choices[0].message.parsed
+        if parsed is not None:
+            self._store(cache_key, parsed, usage)
+        return parsed, usage
+
+    def _store(self, cache_key: str, content: Any, usage):
+        self._cache[cache_key] = (content, usage)
+        if len(self._cache) > RESPONSE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def chat_completion_stream(self, system_message: dict, messages: list[dict], model: str = OPENAI_MODEL, temperature: float = 0.0, max_tokens: int = 500):
+        """
+        Stream OpenAI's chat completion for the provided messages.
+        Yields content deltas as they arrive; the usage reported in the final
+        chunk is stored on last_stream_usage once the stream is exhausted.
+        """
+        self.last_stream_usage = None
+        input_messages = [system_message, *messages] if system_message else list(messages)
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=input_messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for chunk in stream:
+            if chunk.usage is not None:
+                self.last_stream_usage = chunk.usage
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ""
 
 def log_openai_cost(usage, logger):
     if usage:
         total_tokens = usage.total_tokens
         cost = ((usage.prompt_tokens / 1000) * MODEL_PRICE_PER_INPUT_1K_TOKENS) + ((usage.completion_tokens/1000)* MODEL_PRICE_PER_OUTPUT_1K_TOKENS)
-        logger.info(f"OpenAI API usage: prompt_tokens={usage.prompt_tokens}, completion_tokens={usage.completion_tokens}, total_tokens={total_tokens}, estimated_cost=${cost:.6f}")
+        logger.info("OpenAI API usage: prompt_tokens=%s, completion_tokens=%s, total_tokens=%s, estimated_cost=$%.6f", usage.prompt_tokens, usage.completion_tokens, total_tokens, cost)
+
+def _window(messages: list[dict], k: int = CLASSIFIER_WINDOW_SIZE) -> list[dict]:
+    """Return the last k messages, classifiers only need the recent turns."""
+    return messages[-k:]
 
 def initialize_session_state():
     """Initialize session state variables."""
@@ -116,28 +209,32 @@ if __name__ == "__main__":
         show_login_page()
         st.stop()
     
-    service = CalculationService(CREDENTIALS_DATA)
+    # Keep the service per session so its Sheets client and workbook cache survive reruns
+    if 'calculation_service' not in st.session_state:
+        st.session_state.calculation_service = CalculationService(CREDENTIALS_DATA)
+    service = st.session_state.calculation_service
     
     # Create sidebar with logout button
     create_sidebar()
     add_logout_button()
         
     # Main header
-    st.markdown('<h1 style="font-size: 2.5rem; font-weight: bold; color: #000000; text-align: center; margin-bottom: 1rem;">🔋 Station Planning Tool</h1>', unsafe_allow_html=True)
-    st.markdown('<p style="text-align: center; font-size: 1.2rem; color: #000000;">Your intelligent assistant for station (QIS) planning</p>', unsafe_allow_html=True)
+    st.markdown('<h1 class="main-header">🔋 Station Planning Tool</h1><p class="sub-header">Your intelligent assistant for station (QIS) planning</p>', unsafe_allow_html=True)
     
-    #Initialize OpenAI client
-    openai_client = OPENAI_CALL(OPENAI_API_KEY)
+    #Initialize OpenAI client once per session so reruns reuse it
+    if 'openai_client' not in st.session_state:
+        st.session_state.openai_client = OPENAI_CALL(OPENAI_API_KEY)
+    openai_client = st.session_state.openai_client
     
     # Chat messages container
     chat_container = st.container()
     with chat_container:
-        for message in st.session_state.messages:
+        for index, message in enumerate(st.session_state.messages):
             with st.chat_message(message['role']):
                 st.markdown(message['content'])
-                if 'data' in message:
-                    with st.expander("📊 View Data", expanded=False):
-                        display_calculation_results(message['data'])
+                # Past results are only rebuilt when opened, not on every rerun
+                if 'data' in message and st.toggle("📊 View Data", key=f"view_data_{index}"):
+                    display_calculation_results(message['data'])
     
     # Chat input
     if prompt := st.chat_input("💭 Type your message here..."):
@@ -147,36 +244,39 @@ if __name__ == "__main__":
         # Generate assistant response
         with st.chat_message("assistant"):
             with st.spinner("🧠 Analyzing your request..."):
-                # Call the intent classifier
-                intent_response, usage = openai_client.chat_completion(INTENT_PROMPT, st.session_state.messages, INTENT_RESPONSE_FORMAT)
-                log_openai_cost(usage, logger)
-                intent_response = json.loads(intent_response).get("intent", "")
-                logger.info(f"Intent Response: {intent_response}")
+                if len(prompt) < GREETING_FAST_PATH_MAX_LENGTH and GREETING_FAST_PATH_RE.match(prompt):
+                    combined_response = None
+                    intent_response = "greeting"
+                    logger.info("fastpath_hit: intent=%s", intent_response)
+                else:
+                    # Classify intent, extract entities and confirmation state in one call
+                    classifier_messages = _window(st.session_state.messages)
+                    logger.info("Classifier input: %s of %s messages", len(classifier_messages), len(st.session_state.messages))
+                    combined_response, usage = openai_client.chat_completion_parsed(COMBINED_SYS_MSG, classifier_messages, CombinedResponse)
+                    log_openai_cost(usage, logger)
+                    intent_response = combined_response.intent if combined_response else ""
+                logger.info("Intent Response: %s", intent_response)
 
                 if intent_response == "calculate_stations":
-                    entity_response, usage = openai_client.chat_completion(ENTITY_EXTRACTOR_PROMPT, st.session_state.messages, ENTITY_EXTRACTOR_RESPONSE_FORMAT)
-                    log_openai_cost(usage, logger)
-                    entity_response = json.loads(entity_response)
-                    logger.info(f"Entity Response: {entity_response}")
+                    entity_response = [location.model_dump(exclude_none=True) for location in combined_response.locations or []]
+                    logger.info("Entity Response: %s", entity_response)
 
-                    entity_response = entity_response.get("locations", [])
-                    entity_response = {d["name"].lower(): {k: v for k, v in d.items() if k != "name"} for d in entity_response}
+                    # Key each location's parameters by its lowercased name, reusing the dumped dicts
+                    locations = {}
+                    for location in entity_response:
+                        locations[location.pop("name").lower()] = location
+                    entity_response = locations
                     missing_info_messages = []
                     for city, config in entity_response.items():
-                        missing_fields = []
-                        if "station_utilization_percentage" not in config:
-                            missing_fields.append("station utilization percentage")
-                        if "off_road_vehicle_percentage" not in config:
-                            missing_fields.append("off road vehicle percentage")
-                        
-                        if missing_fields:
-                            fields = " and ".join(missing_fields)
+                        missing = REQUIRED_ENTITY_KEYS - config.keys()
+                        if missing:
+                            fields = " and ".join(label for key, label in ENTITY_FIELD_LABELS.items() if key in missing)
                             missing_info_messages.append(f"Please provide {fields} for '{city}'.")
 
                     if len(missing_info_messages)>0:
                         for msg in missing_info_messages:
-                            logger.warning(f"Missing information for calculation: {msg}")
-                            all_combined_messages = "\n".join(missing_info_messages)
+                            logger.warning("Missing information for calculation: %s", msg)
+                        all_combined_messages = "\n".join(missing_info_messages)
                         ai_response = "I need some more information to proceed with the calculation. Please provide the following details for each location:" + f"\n\n{all_combined_messages}"
                         st.markdown(ai_response)
                         st.session_state.messages.append({"role": "assistant", "content": ai_response})
@@ -184,10 +284,8 @@ if __name__ == "__main__":
                     
 
                     else:
-                        confirmation_state, usage = openai_client.chat_completion(USER_CONFIRMATION_STATE_PROMPT, st.session_state.messages, response_format=USER_CONFIRMATION_STATE_RESPONSE_FORMAT)
-                        confirmation_state = json.loads(confirmation_state).get("confirmation_state", "not_confirmed")
-                        log_openai_cost(usage, logger)
-                        logger.info(f"User Confirmation State: {confirmation_state}")
+                        confirmation_state = combined_response.confirmation_state or "not_confirmed"
+                        logger.info("User Confirmation State: %s", confirmation_state)
                         if confirmation_state== "confirmed":
                             # Proceed with calculation
                             with st.spinner("🔄 Processing calculation..."):
@@ -195,12 +293,11 @@ if __name__ == "__main__":
                                     entities=entity_response ,
                                     sheet_url=SHEET_URL
                                 )
-                            ai_response, usage = openai_client.chat_completion(DATA_SUMMARY_PROMPT, [{"role": "user" , "content": f" swap stations data: {json.dumps(response)} entities extracted : {json.dumps(entity_response)}"}], max_tokens=1000)
-                            log_openai_cost(usage, logger)
-                            logging.info(f"AI Response based on data: {ai_response}")
-                            st.markdown(ai_response)
+                            ai_response = st.write_stream(openai_client.chat_completion_stream(DATA_SUMMARY_SYS_MSG, [{"role": "user" , "content": f" swap stations data: {orjson.dumps(response, option=orjson.OPT_SERIALIZE_NUMPY).decode()} entities extracted : {orjson.dumps(entity_response).decode()}"}], max_tokens=1000))
+                            log_openai_cost(openai_client.last_stream_usage, logger)
+                            logger.info("AI Response based on data: %s", ai_response)
                             # Display fancy results
-                            logger.info(f"Calculation Response: {response}")
+                            logger.info("Calculation Response: %s", response)
                             display_calculation_results(response)
                             # st.session_state.awaiting_confirmation = False
                             st.session_state.messages.append({"role": "assistant", "content": ai_response, "data": response})
@@ -211,17 +308,17 @@ if __name__ == "__main__":
                             st.session_state.messages.append({"role": "assistant", "content": ai_response})
 
                 elif intent_response == "greeting":
-                    ai_response, usage = openai_client.chat_completion(GREETING_PROMPT, st.session_state.messages)
+                    ai_response, usage = openai_client.chat_completion(GREETING_SYS_MSG, st.session_state.messages)
                     log_openai_cost(usage, logger)
                     st.markdown(ai_response)
                     st.session_state.messages.append({"role": "assistant", "content": ai_response})
                 elif intent_response == "negative_feedback":
-                    ai_response, usage = openai_client.chat_completion(NEGATIVE_FEEDBACK_PROMPT, st.session_state.messages)
+                    ai_response, usage = openai_client.chat_completion(NEGATIVE_FEEDBACK_SYS_MSG, st.session_state.messages)
                     log_openai_cost(usage, logger)
                     st.markdown(ai_response)
                     st.session_state.messages.append({"role": "assistant", "content": ai_response})
                 elif intent_response == "irrelevant":
-                    ai_response, usage = openai_client.chat_completion(IRREVELANT_PROMPT, st.session_state.messages)
+                    ai_response, usage = openai_client.chat_completion(IRREVELANT_SYS_MSG, st.session_state.messages)
                     log_openai_cost(usage, logger)
                     st.markdown(ai_response)
                     st.session_state.messages.append({"role": "assistant", "content": ai_response})
@@ -2,9 +2,9 @@
 Authentication module for IndoFast AI Copilot
 """
 import streamlit as st
-import hashlib
+import hmac
 import time
-from config import AUTH_TOKENS
+from config import AUTH_TOKENS, hash_token
 
 def check_authentication():
     """
@@ -21,9 +21,11 @@ def check_authentication():
 
 def authenticate_user(token):
     """
-    Authenticate user with provided token
+    Authenticate user with provided token.
+    Tokens are compared as digests in constant time.
     """
-    if token in AUTH_TOKENS:
+    token_hash = hash_token(token)
+    if any(hmac.compare_digest(token_hash, valid_hash) for valid_hash in AUTH_TOKENS):
         st.session_state.authenticated = True
         st.session_state.auth_token = token
         st.session_state.auth_time = time.time()
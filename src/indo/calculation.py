@@ -2,10 +2,12 @@
 
 import time
 import logging
-import math
+from dataclasses import dataclass
+import numpy as np
 import pandas as pd
 import gspread
-from typing import Dict, Any, List
+from gspread.utils import absolute_range_name, fill_gaps
+from typing import Dict, Any, List, Tuple
 from datetime import datetime
 from google.oauth2.service_account import Credentials
 import json
@@ -13,6 +15,27 @@ import traceback
 
 logger = logging.getLogger(__name__)
 
+# Worksheet indexes in the planning workbook
+VEHICLE_DATA_WORKSHEET = 0
+STATION_SPECS_WORKSHEET = 1
+# Zero-based (row, column) of the swappable energy per station cell (H5)
+SWAPPABLE_ENERGY_CELL = (4, 7)
+# Seconds fetched workbook values may be reused while the sheet is unmodified
+WORKBOOK_CACHE_TTL = 300
+
+@dataclass(frozen=True)
+class VehicleMix:
+    """Vehicle Mix specs as parallel arrays, one entry per vehicle type."""
+    vehicle_types: List[str]
+    km_per_day: np.ndarray
+    wh_per_km: np.ndarray
+
+    @property
+    def energy_per_vehicle(self) -> np.ndarray:
+        """Daily energy per vehicle of each type, converted from Wh to kWh."""
+        return self.km_per_day * self.wh_per_km / 1000
+
+
 class CalculationService:
     """Service for calculating battery swap station requirements for EV fleet planning."""
     
@@ -22,6 +45,10 @@ class CalculationService:
         # Authenticate with Google Sheets
         self.credentials_data = credentials_data
         self.gspread_client = self._google_sheets_auth(self.credentials_data)
+        # sheet_url -> opened spreadsheet
+        self._sheet_cache: Dict[str, gspread.Spreadsheet] = {}
+        # sheet_url -> (modified time, fetched at, worksheet values)
+        self._workbook_cache: Dict[str, Tuple[str, float, Tuple[List[List[Any]], List[List[Any]]]]] = {}
      
     
     def _google_sheets_auth(self, credentials_data: str) -> gspread.Client:
@@ -69,77 +96,112 @@ class CalculationService:
         
         try:
             cities = list(entities.keys()) if entities else ['all']
-            # Step 1: Setup Google Sheets connection
-            df = self._get_vehicle_data_from_sheets(sheet_url, cities)
-            swappable_energy_per_station, vehicle_specs = self._get_swappable_energy_per_station_and_vehicle_mix(sheet_url)
+            # Step 1: Fetch both worksheets in a single request
+            vehicle_values, station_spec_values = self._fetch_workbook_values(sheet_url)
+            df = self._get_vehicle_data_from_sheets(vehicle_values, cities)
+            swappable_energy_per_station, vehicle_mix = self._get_swappable_energy_per_station_and_vehicle_mix(station_spec_values)
             swappable_energy_per_station = int(swappable_energy_per_station)
-            # Step 3: Calculate for each city
-            results = []
-            for _, row in df.iterrows():
-                
-                city = row['City']
-                if cities != ['all']:
-                    off_road_vehicle_percentage = entities.get(city).get('off_road_vehicle_percentage')/100
-                    station_utilization_percentage = entities.get(city).get('station_utilization_percentage') / 100.0
-                else:
-                    off_road_vehicle_percentage = entities.get('all').get('off_road_vehicle_percentage')/100
-                    station_utilization_percentage = entities.get('all').get('station_utilization_percentage') / 100.0
-                logger.info(f"Processing city: {city}")
-                
-                # Calculate total energy required for the city
-                total_energy_required = self._calculate_city_energy_demand(
-                    row, vehicle_specs, off_road_vehicle_percentage
-                )
-                ### Hot fix for jaipur
-                if city.lower() == 'jaipur':  
-                    swappable_energy_per_station = 222
-            
-                # Calculate stations required
-                if swappable_energy_per_station > 0 and (station_utilization_percentage) > 0:
-                    stations_required = total_energy_required / (
-                        swappable_energy_per_station * (station_utilization_percentage)
-                    )
-                else:
-                    stations_required = 0
+            # Step 2: Per-entity (off road, utilization) fractions, converted once in a single table
+            params_by_entity = pd.DataFrame.from_dict(entities, orient='index')[
+                ['off_road_vehicle_percentage', 'station_utilization_percentage']
+            ] / 100.0
+            if cities == ['all']:
+                city_params = np.broadcast_to(params_by_entity.loc['all'].to_numpy(dtype=np.float64), (len(df), 2))
+            else:
+                city_params = params_by_entity.reindex(df['City']).to_numpy(dtype=np.float64)
+            off_road_vehicle_percentage, station_utilization_percentage = city_params[:, 0], city_params[:, 1]
 
-                total_vehicles = sum(value for value in row.to_dict().values() if isinstance(value, (int, float)))
-                
-                results.append({
-                    "City": city,
-                    "vehicles": row.to_dict(),
-                    "total_vehicles": total_vehicles,
-                    "operational_vehicles": total_vehicles * (1 - off_road_vehicle_percentage),
-                    "energy_required": round(total_energy_required, 2),
-                    "swappable_energy_per_station": round(swappable_energy_per_station, 0),
-                    "stations_required": round(stations_required, 0)
-                })
-                
-                logger.info(f"City {city}: {math.ceil(stations_required)} stations required")
-            
-            result_df = pd.DataFrame(results)
+            # Step 3: Calculate for all cities at once
+            total_energy_required = self._calculate_city_energy_demand(
+                df, vehicle_mix, off_road_vehicle_percentage
+            )
+            ### Hot fix for jaipur, the override carries over to every city after it
+            after_jaipur = np.maximum.accumulate((df['City'].str.lower() == 'jaipur').to_numpy())
+            swappable_energy = np.where(after_jaipur, 222, swappable_energy_per_station)
+
+            # Calculate stations required, divide only where capacity is positive and leave 0 elsewhere
+            station_capacity = swappable_energy * station_utilization_percentage
+            stations_required = np.divide(
+                total_energy_required,
+                station_capacity,
+                out=np.zeros_like(total_energy_required),
+                where=(swappable_energy > 0) & (station_utilization_percentage > 0)
+            )
+
+            numeric_cols = df.select_dtypes(include='number').columns
+            # Only the vehicle count columns are needed downstream, not the City label
+            vehicles = df[numeric_cols].to_dict('records')
+            total_vehicles = df[numeric_cols].sum(axis=1).to_numpy()
+
+            result_df = pd.DataFrame({
+                "City": df['City'].to_numpy(),
+                "vehicles": vehicles,
+                "total_vehicles": total_vehicles,
+                "operational_vehicles": total_vehicles * (1 - off_road_vehicle_percentage),
+                "energy_required": np.round(total_energy_required, 2),
+                "swappable_energy_per_station": swappable_energy,
+                "stations_required": np.round(stations_required, 0)
+            })
+
+            stations_ceil = np.ceil(stations_required).astype(np.int64)
+            for city, city_stations in zip(result_df['City'], stations_ceil):
+                logger.info(f"City {city}: {city_stations} stations required")
             
-            logger.info(f"Calculation completed for {len(results)} cities")
+            logger.info(f"Calculation completed for {len(result_df)} cities")
             return result_df
             
         except Exception as e:
             logger.error(f"Error in detailed calculation: {e}")
             raise
 
-    def _get_swappable_energy_per_station_and_vehicle_mix(self, sheet_url: str) -> float:
-        """Retrieve swappable energy per station from Google Sheets."""
+    def _open_sheet(self, sheet_url: str) -> gspread.Spreadsheet:
+        """Open a spreadsheet once and reuse it, opening costs a metadata request."""
+        if sheet_url not in self._sheet_cache:
+            self._sheet_cache[sheet_url] = self.gspread_client.open_by_url(sheet_url)
+        return self._sheet_cache[sheet_url]
+
+    def _fetch_workbook_values(self, sheet_url: str) -> Tuple[List[List[Any]], List[List[Any]]]:
+        """
+        Fetch the vehicle data and station specs worksheets with one batchGet request.
+        Values are reused for WORKBOOK_CACHE_TTL seconds as long as the sheet's
+        Drive modified time is unchanged, so edits made by users are always picked up.
+        The modified time needs the Drive API; if it is unavailable values are fetched uncached.
+        
+        Returns:
+            Tuple of (vehicle data values, station specs values), each padded to a rectangle.
+        """
+        sheet = self._open_sheet(sheet_url)
+        try:
+            modified_time = sheet.get_lastUpdateTime()
+        except gspread.exceptions.APIError as e:
+            logger.warning(f"Could not read sheet modified time, fetching workbook values uncached: {e}")
+            modified_time = None
+        cached = self._workbook_cache.get(sheet_url)
+        if cached and modified_time is not None and cached[0] == modified_time and time.time() - cached[1] < WORKBOOK_CACHE_TTL:
+            logger.info(f"Using cached workbook values (modified {modified_time})")
+            return cached[2]
+
+        worksheets = sheet.worksheets()
+        ranges = [
+            absolute_range_name(worksheets[VEHICLE_DATA_WORKSHEET].title),
+            absolute_range_name(worksheets[STATION_SPECS_WORKSHEET].title),
+        ]
+        # Numbers come back as numbers rather than display strings like "1,200"
+        value_ranges = sheet.values_batch_get(ranges, params={"valueRenderOption": "UNFORMATTED_VALUE"})["valueRanges"]
+        vehicle_values, station_spec_values = (fill_gaps(value_range.get("values", [])) for value_range in value_ranges)
+        # Without a modified time the values cannot be checked for edits, so they are not stored
+        if modified_time is not None:
+            self._workbook_cache[sheet_url] = (modified_time, time.time(), (vehicle_values, station_spec_values))
+        return vehicle_values, station_spec_values
+
+    def _get_swappable_energy_per_station_and_vehicle_mix(self, all_values: List[List[Any]]) -> Tuple[Any, VehicleMix]:
+        """Extract swappable energy per station and the vehicle mix from the station specs worksheet."""
         try:
-           
-            # Open sheet and get data
-            sheet = self.gspread_client.open_by_url(sheet_url)
-            worksheet = sheet.get_worksheet(1)  # Assuming swappable energy is in the second sheet
-    
-            swapable_energy = worksheet.acell('H5').value
-            vehicle_start = None
-            for i, row in enumerate(worksheet.get_all_values()):
-                if any('Vehicle Mix' in str(cell) for cell in row):
-                    vehicle_start = i
-                    break
-            all_values = worksheet.get_all_values()
+            energy_row, energy_col = SWAPPABLE_ENERGY_CELL
+            swapable_energy = all_values[energy_row][energy_col]
+            # First row with a cell containing 'Vehicle Mix'
+            header_mask = (np.char.find(np.asarray(all_values, dtype=str), 'Vehicle Mix') >= 0).any(axis=1)
+            vehicle_start = int(header_mask.argmax()) if header_mask.any() else None
             # Extract Vehicle Mix DataFrame
             if vehicle_start:
                 vehicle_data = all_values[vehicle_start:]
@@ -156,7 +218,12 @@ class CalculationService:
                 else:
                     vehicle_df = pd.DataFrame(columns=['Vehicle Mix', 'Avg. km per day (km/day)', 'Energy required per km (wh/km)'])
 
-            return swapable_energy, vehicle_df.set_index(vehicle_df.columns[0]).to_dict('index')
+            vehicle_mix = VehicleMix(
+                vehicle_types=vehicle_df['Vehicle Mix'].tolist(),
+                km_per_day=vehicle_df['Avg. km per day (km/day)'].to_numpy(dtype=np.float64),
+                wh_per_km=vehicle_df['Energy required per km (wh/km)'].to_numpy(dtype=np.float64)
+            )
+            return swapable_energy, vehicle_mix
         
         except Exception as e:
             logger.error(f"Error retrieving swappable energy per station: {e}")
@@ -164,15 +231,10 @@ class CalculationService:
 
     def _get_vehicle_data_from_sheets(
         self, 
-        sheet_url: str, 
+        data: List[List[Any]], 
         cities: List[str]
     ) -> pd.DataFrame:
-        """Retrieve and process vehicle data from Google Sheets."""
-    
-        # Open sheet and get data
-        sheet = self.gspread_client.open_by_url(sheet_url)
-        worksheet = sheet.get_worksheet(0)
-        data = worksheet.get_all_values()
+        """Process vehicle data fetched from the vehicle data worksheet."""
         
         if not data or len(data) < 2:
             raise ValueError("Insufficient data in Google Sheets")
@@ -182,14 +244,8 @@ class CalculationService:
         values = data[1:]
         df = pd.DataFrame(values, columns=headers)
         
-        # Convert numeric columns
-        for col in df.columns[1:]:  # Skip 'City' column
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-
         # Clean city names
-        df['City'] = df['City'].str.strip()
-        df['City'] = df['City'].str.lower()
+        df['City'] = df['City'].str.strip().str.lower()
         
         # Filter cities if not 'all'
         if cities!=['all']:
@@ -198,38 +254,27 @@ class CalculationService:
             if df.empty:
                 raise ValueError(f"No matching cities found for: {cities}")
         
+        # Convert numeric columns in one pass, only for the selected cities
+        numeric = df.iloc[:, 1:].apply(pd.to_numeric, errors='coerce').fillna(0)  # Skip 'City' column
+        df = pd.concat([df.iloc[:, :1], numeric], axis=1)
+        
         logger.info(f"Retrieved data for {len(df)} cities from Google Sheets")
         return df
             
     def _calculate_city_energy_demand(
         self, 
-        city_row: pd.Series, 
-        vehicle_specs: Dict, 
-        off_road_percent: float
-    ) -> float:
-        """Calculate total energy demand for a city."""
-        total_energy_required = 0
+        df: pd.DataFrame, 
+        vehicle_mix: VehicleMix, 
+        off_road_percent: np.ndarray
+    ) -> np.ndarray:
+        """Calculate total energy demand (kWh) for every city row in df."""
+        # Vehicle types missing from the sheet contribute nothing
+        vehicle_types = pd.Index(vehicle_mix.vehicle_types)
+        present = vehicle_types.isin(df.columns)
         
-        for vehicle_type in vehicle_specs:
-            if vehicle_type not in city_row:
-                continue
-                
-            count = city_row[vehicle_type]
-            specs = vehicle_specs[vehicle_type]
-            
-            # Apply off-road factor
-            effective_vehicles = count * (1 - off_road_percent)
-            
-            # Calculate energy requirement
-            energy_required = (
-                effective_vehicles * 
-                specs['Avg. km per day (km/day)'] * 
-                specs['Energy required per km (wh/km)']
-            )/1000  # Convert Wh to kWh
-            
-            total_energy_required += energy_required
-            
-        return total_energy_required
+        counts = df[vehicle_types[present]].to_numpy(dtype=np.float64)
+        # Apply off-road factor
+        return (1 - off_road_percent) * counts.dot(vehicle_mix.energy_per_vehicle[present])
 
     
     def calculate_swap_stations(
@@ -260,15 +305,8 @@ class CalculationService:
             )
             
             # Convert DataFrame to the expected format for Streamlit
-            city_breakdown = {}
-            total_stations = 0
-            
-            for _, row in results_df.iterrows():
-                city = row['City']
-                stations = row['stations_required']
-                
-                city_breakdown[city] = row.to_dict()
-                total_stations += stations
+            city_breakdown = dict(zip(results_df['City'], results_df.to_dict('records')))
+            total_stations = results_df['stations_required'].sum()
             
             calculation_time = time.time() - start_time
             
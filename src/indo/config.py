@@ -1,7 +1,14 @@
 import streamlit as st
-import json
+import orjson
+import hashlib
+
+
+def hash_token(token: str) -> str:
+    """Digest used to store and compare auth tokens."""
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
 OPENAI_API_KEY = st.secrets.get("OPENAI_API_KEY")
-AUTH_TOKENS = st.secrets.get("AUTH_TOKENS")['tokens']
+AUTH_TOKENS = frozenset(hash_token(token) for token in st.secrets.get("AUTH_TOKENS")['tokens'])
 SHEET_URL = st.secrets.get("SHEET_URL")
 
-CREDENTIALS_DATA = json.loads(st.secrets["CREDENTIALS_DATA"]["service_account_json"])
+CREDENTIALS_DATA = orjson.loads(st.secrets["CREDENTIALS_DATA"]["service_account_json"])
@@ -1,3 +1,7 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
 GREETING_PROMPT = """
     You are a friendly assistant for IndoFast's battery swap station (QIS) planning copilot.
     Your primary function is to help users plan and calculate battery swap station requirements.
@@ -52,56 +56,6 @@ INTENT_PROMPT = """
 
 """
 
-intent_response_schema = {
-    "type": "object",
-    "properties": {
-        "intent": {
-            "type": "string",
-            "enum": ["greeting", "calculate_stations", "negative_feedback", "irrelevant"],
-        }
-    },
-    "required": ["intent"],
-    "additionalProperties": False
-}
-
-INTENT_RESPONSE_FORMAT = {
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "intent_response",
-                    "schema": intent_response_schema,
-                    "strict": True
-                }
-            }
-
-
-
-ENTITY_EXTRACTOR_RESPONSE_FORMAT = {
-    "type": "json_schema",  
-    "json_schema": {
-        "name": "entity_extractor_response",
-        "schema": {
-            "type": "object",
-            "properties": {
-                "locations": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "name": {"type": "string"},
-                            "station_utilization_percentage": {"type": "number"},
-                            "off_road_vehicle_percentage": {"type": "number"}
-                        },
-                        "required": ["name"],
-                        "additionalProperties": False
-                    }
-                }
-            },
-            "required": ["locations"],
-            "additionalProperties": False
-        }
-    }
-}
-
 DATA_SUMMARY_PROMPT = f"""You are a data summarizer for IndoFast's swap station (QIS) planning copilot.
     Summarize the provided data in a very concise manner in english. Mention the following details:
     - Location
@@ -119,20 +73,34 @@ USER_CONFIRMATION_STATE_PROMPT = """Classify the user's confirmation state based
     Respond with only the confirmation state in json format with key as confirmation_state and values as one of these (confirmed, not_confirmed).
     """
 
-USER_CONFIRMATION_STATE_RESPONSE_FORMAT = {
-    "type": "json_schema",
-    "json_schema": {
-        "name": "user_confirmation_state_response",
-        "schema": {
-            "type": "object",
-            "properties": {
-                "confirmation_state": {
-                    "type": "string",
-                    "enum": ["confirmed", "not_confirmed"]
-                }
-            },
-            "required": ["confirmation_state"],
-            "additionalProperties": False
-        }
-    }
-}
+COMBINED_PROMPT = f"""You are a multi-task classifier for IndoFast's swap station (QIS) planning copilot.
+    Perform the three tasks below on the same conversation and respond with a single json object with keys intent, locations and confirmation_state.
+    Fill locations and confirmation_state only when the intent is calculate_stations, otherwise set them to null.
+
+    ### Task 1: intent
+    {INTENT_PROMPT}
+    ### Task 2: locations
+    {ENTITY_EXTRACTOR_PROMPT}
+    ### Task 3: confirmation_state
+    {USER_CONFIRMATION_STATE_PROMPT}
+    """
+
+class Location(BaseModel):
+    name: str
+    station_utilization_percentage: Optional[float] = None
+    off_road_vehicle_percentage: Optional[float] = None
+
+
+# Structured output of COMBINED_PROMPT, parsed directly by the OpenAI SDK.
+# Kept as a comment since a docstring would be sent to the model as the schema description.
+class CombinedResponse(BaseModel):
+    intent: Literal["greeting", "calculate_stations", "negative_feedback", "irrelevant"]
+    locations: Optional[list[Location]] = None
+    confirmation_state: Optional[Literal["confirmed", "not_confirmed"]] = None
+
+# System messages built once at import time and prepended to each request
+GREETING_SYS_MSG = {"role": "system", "content": GREETING_PROMPT}
+IRREVELANT_SYS_MSG = {"role": "system", "content": IRREVELANT_PROMPT}
+NEGATIVE_FEEDBACK_SYS_MSG = {"role": "system", "content": NEGATIVE_FEEDBACK_PROMPT}
+DATA_SUMMARY_SYS_MSG = {"role": "system", "content": DATA_SUMMARY_PROMPT}
+COMBINED_SYS_MSG = {"role": "system", "content": COMBINED_PROMPT}
@@ -6,6 +6,91 @@ from plotly.subplots import make_subplots
 import uuid
 from config import SHEET_URL
 
+# Figures are pure functions of the results, so reruns that do not change
+# the data (sidebar clicks, new chat messages) reuse the cached figures.
+@st.cache_data(max_entries=32)
+def build_stations_bar_chart(df):
+    """Bar chart of stations required per city."""
+    # Bar chart for stations required
+    fig_bar = px.bar(
+        df, 
+        x='city', 
+        y='stations_required',
+        title="Battery Swap Stations Required by City",
+        color='stations_required',
+        color_continuous_scale='Blues',
+        text='stations_required'
+    )
+    fig_bar.update_layout(
+        xaxis_title="City",
+        yaxis_title="Stations Required",
+        title_x=0.5,
+        height=500
+    )
+    fig_bar.update_traces(texttemplate='%{text:.0f}', textposition='outside')
+    return fig_bar
+
+
+@st.cache_data(max_entries=32)
+def build_vehicle_distribution_chart(vehicles_df):
+    """Stacked bar chart of vehicle counts per city from a vehicle types x cities frame."""
+    # One stacked trace per vehicle type, in sheet order
+    fig_vehicles = go.Figure()
+    
+    for vehicle_type in vehicles_df.index:
+        values = vehicles_df.loc[vehicle_type].tolist()
+        
+        fig_vehicles.add_trace(go.Bar(
+            name=vehicle_type,
+            x=vehicles_df.columns,
+            y=values,
+            text=values,
+            textposition='inside'
+        ))
+    
+    fig_vehicles.update_layout(
+        title="Vehicle Type Distribution by City",
+        xaxis_title="City",
+        yaxis_title="Number of Vehicles",
+        barmode='stack',
+        height=400,
+        title_x=0.5
+    )
+    return fig_vehicles
+
+
+@st.cache_data(max_entries=32)
+def build_distribution_pie_charts(df):
+    """Side by side pie charts of vehicles and stations per city."""
+    # Create subplots for pie charts
+    fig_pie = make_subplots(
+        rows=1, cols=2,
+        specs=[[{"type": "domain"}, {"type": "domain"}]],
+        subplot_titles=("Vehicle Distribution", "Station Distribution")
+    )
+    
+    # Vehicle distribution pie chart
+    fig_pie.add_trace(go.Pie(
+        labels=df['city'],
+        values=df['total_vehicles'],
+        name="Vehicles",
+        hole=0.3,
+        textinfo='label+percent+value'
+    ), 1, 1)
+    
+    # Station distribution pie chart
+    fig_pie.add_trace(go.Pie(
+        labels=df['city'],
+        values=df['stations_required'],
+        name="Stations",
+        hole=0.3,
+        textinfo='label+percent+value'
+    ), 1, 2)
+    
+    fig_pie.update_layout(height=500, title_text="Distribution Analysis", title_x=0.5)
+    return fig_pie
+
+
 def display_calculation_results(response):
     """Display calculation results with fancy visualizations."""
     if not response or 'city_breakdown' not in response:
@@ -16,29 +101,13 @@ def display_calculation_results(response):
     # Store results in session state
     st.session_state.calculation_results = response
     
-    # Process the city_breakdown data
-    city_data = []
-    
-    for city_info in response['city_breakdown'].items():
-        city_name = city_info[0]
-        
-        # Extract vehicle types (excluding non-vehicle keys)
-        vehicle_types = {}
-        for key, value in city_info[1]['vehicles'].items():
-            if key not in ['City']:
-                vehicle_types[key] = value
-        
-        city_data.append({
-            'city': city_name,
-            'total_vehicles': city_info[1]['total_vehicles'],
-            'stations_required': city_info[1]['stations_required'],
-            'energy_required': city_info[1]['energy_required'],
-            'swappable_energy_per_station': city_info[1]['swappable_energy_per_station'],
-            'vehicle_types': vehicle_types,
-            'operational_vehicles': city_info[1]['operational_vehicles']
-        })
-    
-    df = pd.DataFrame(city_data)
+    # Process the city_breakdown data: one row per city, and vehicle types x cities counts
+    city_breakdown = response['city_breakdown']
+    df = pd.DataFrame.from_dict(city_breakdown, orient='index').rename_axis('city').reset_index()
+    vehicles_df = (
+        pd.DataFrame({city: info['vehicles'] for city, info in city_breakdown.items()})
+        .fillna(0)
+    )
     
     # Add operational vehicles calculation based on VOR
     # vor_percentage = response['parameters_used'].get('off_road_percentage', 0)
@@ -108,20 +177,14 @@ def display_calculation_results(response):
         
         # Vehicle breakdown details
         st.markdown("### 🚗 Vehicle Type Breakdown")
-        vehicle_breakdown_data = []
-        
-        for _, row in df.iterrows():
-            city = row['city']
-            vehicle_types = row['vehicle_types']
-            for vehicle_type, count in vehicle_types.items():
-                vehicle_breakdown_data.append({
-                    'City': city,
-                    'Vehicle Type': vehicle_type,
-                    'Count': count
-                })
+        vehicle_df = (
+            vehicles_df.rename_axis('Vehicle Type')
+            .reset_index()
+            .melt(id_vars='Vehicle Type', var_name='City', value_name='Count')
+            [['City', 'Vehicle Type', 'Count']]
+        )
         
-        if vehicle_breakdown_data:
-            vehicle_df = pd.DataFrame(vehicle_breakdown_data)
+        if not vehicle_df.empty:
             st.dataframe(vehicle_df, use_container_width=True, height=300)
         
         # Download button
@@ -138,90 +201,19 @@ def display_calculation_results(response):
     with tab2:
         st.markdown("### 📊 Stations Required by City")
         
-        # Bar chart for stations required
-        fig_bar = px.bar(
-            df, 
-            x='city', 
-            y='stations_required',
-            title="Battery Swap Stations Required by City",
-            color='stations_required',
-            color_continuous_scale='Blues',
-            text='stations_required'
-        )
-        fig_bar.update_layout(
-            xaxis_title="City",
-            yaxis_title="Stations Required",
-            title_x=0.5,
-            height=500
-        )
-        fig_bar.update_traces(texttemplate='%{text:.0f}', textposition='outside')
+        fig_bar = build_stations_bar_chart(df[['city', 'stations_required']])
         st.plotly_chart(fig_bar, use_container_width=True)
         
         # Vehicle type breakdown chart
         st.markdown("### 🚗 Vehicle Distribution by City")
         
-        # Prepare data for stacked bar chart
-        vehicle_breakdown_for_chart = []
-        all_vehicle_types = set()
-        
-        for _, row in df.iterrows():
-            for vehicle_type in row['vehicle_types'].keys():
-                all_vehicle_types.add(vehicle_type)
-        
-        fig_vehicles = go.Figure()
-        
-        for vehicle_type in all_vehicle_types:
-            values = []
-            for _, row in df.iterrows():
-                values.append(row['vehicle_types'].get(vehicle_type, 0))
-            
-            fig_vehicles.add_trace(go.Bar(
-                name=vehicle_type,
-                x=df['city'],
-                y=values,
-                text=values,
-                textposition='inside'
-            ))
-        
-        fig_vehicles.update_layout(
-            title="Vehicle Type Distribution by City",
-            xaxis_title="City",
-            yaxis_title="Number of Vehicles",
-            barmode='stack',
-            height=400,
-            title_x=0.5
-        )
+        fig_vehicles = build_vehicle_distribution_chart(vehicles_df)
         st.plotly_chart(fig_vehicles, use_container_width=True)
     
     with tab3:
         st.markdown("### 🥧 Distribution of Vehicles and Stations")
         
-        # Create subplots for pie charts
-        fig_pie = make_subplots(
-            rows=1, cols=2,
-            specs=[[{"type": "domain"}, {"type": "domain"}]],
-            subplot_titles=("Vehicle Distribution", "Station Distribution")
-        )
-        
-        # Vehicle distribution pie chart
-        fig_pie.add_trace(go.Pie(
-            labels=df['city'],
-            values=df['total_vehicles'],
-            name="Vehicles",
-            hole=0.3,
-            textinfo='label+percent+value'
-        ), 1, 1)
-        
-        # Station distribution pie chart
-        fig_pie.add_trace(go.Pie(
-            labels=df['city'],
-            values=df['stations_required'],
-            name="Stations",
-            hole=0.3,
-            textinfo='label+percent+value'
-        ), 1, 2)
-        
-        fig_pie.update_layout(height=500, title_text="Distribution Analysis", title_x=0.5)
+        fig_pie = build_distribution_pie_charts(df[['city', 'total_vehicles', 'stations_required']])
         st.plotly_chart(fig_pie, use_container_width=True)
     
 